@@ -0,0 +1,78 @@
+"""
+Compares #timetable.parse_time() with trying #datetime.strptime() on each
+of the #timetable.time_formats in order, which is how values used to be
+parsed. The inputs include the worst cases for the old approach, that is
+values matching the formats at the end of the list and invalid values.
+
+    $ python bench/bench_parse_time.py [--number N]
+"""
+
+from datetime import datetime
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from git_worklog import timetable
+
+VALUES = [
+  '01/Jan/2026:10:00:00 +0100',  # First format.
+  '10:00',
+  '14/10:00:00',
+  '14/Mar',
+  '03/14/10:00',  # Second to last format.
+  '03/14/10:00:00',  # Last format.
+  'invalid',  # Tries every format.
+]
+
+
+FIELDS = {'Y': 'year', 'm': 'month', 'b': 'month', 'd': 'day', 'H': 'hour',
+  'M': 'minute', 'S': 'second', 'z': 'tzinfo'}
+
+
+def parse_time_strptime(value, dt):
+  for fmt in timetable.time_formats:
+    try:
+      result = datetime.strptime(value, fmt)
+      break
+    except ValueError:
+      pass
+  else:
+    raise ValueError('invalid time string: {!r}'.format(value))
+  filled = set(FIELDS[x[0]] for x in fmt.split('%')[1:])
+  kwargs = {k: getattr(dt, k) for k in set(FIELDS.values()) - filled}
+  if 'day' in filled and 'hour' not in filled:
+    kwargs.update(hour=0, minute=0, second=0)
+  return result.replace(**kwargs)
+
+
+def bench(func, value, dt, number):
+  def call():
+    try:
+      func(value, dt)
+    except ValueError:
+      pass
+  return min(timeit.repeat(call, number=number, repeat=3)) / number * 1e6
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--number', type=int, default=20000)
+  args = parser.parse_args(argv)
+
+  dt = timetable.now()
+  print('{:<28} {:>12} {:>12}'.format('value', 'strptime', 'compiled'))
+  for value in VALUES:
+    old = bench(parse_time_strptime, value, dt, args.number)
+    new = bench(timetable.parse_time, value, dt, args.number)
+    print('{:<28} {:>9.1f} us {:>9.1f} us'.format(value, old, new))
+
+  values = VALUES[-2:-1] * 10000
+  old = min(timeit.repeat(lambda: [parse_time_strptime(x, dt) for x in values], number=1, repeat=3))
+  new = min(timeit.repeat(lambda: timetable.parse_times(values, dt), number=1, repeat=3))
+  print('{:<28} {:>9.1f} ms {:>9.1f} ms'.format('batch of 10000 (last format)', old * 1e3, new * 1e3))
+
+
+if __name__ == '__main__':
+  main()
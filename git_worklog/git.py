@@ -20,11 +20,13 @@
 
 from datetime import datetime
 import collections
+import hashlib
 import io
 import os
 import time
 import subprocess
 import sys
+import zlib
 
 _OutputTuple = collections.namedtuple('_OutputTuple', 'out err')
 _OutputCodeTuple = collections.namedtuple('_OutputTuple', 'out err code')
@@ -140,7 +142,7 @@ def dir(cwd=None, fatal=False, *, __cache={}):
   return None
 
 
-def config(key, value=None, g=False):
+def config(key, value=None, g=False, cwd=None):
   """
   Returns a Git configuration value or writes one.
   """
@@ -153,7 +155,7 @@ def config(key, value=None, g=False):
     cmd.append(value)
 
   try:
-    return dec(run(cmd).out).strip()
+    return dec(run(cmd, cwd=cwd).out).strip()
   except CalledProcessError as exc:
     if exc.returncode == 1:
       return u''
@@ -169,7 +171,55 @@ def show(*args, cwd=None):
     raise
 
 
-def rev_parse(*args):
+def cat_blob(obj, cwd=None, chunk_size=65536):
+  """
+  Streams the contents of the blob *obj* (eg. `worklog:user.tsv`) from
+  `git cat-file` and returns an iterator of binary chunks of at most
+  *chunk_size* bytes. Raises #DoesNotExist immediately if the object can
+  not be read.
+  """
+
+  proc = pipe(['git', 'cat-file', 'blob', obj], merge_err=False, cwd=cwd)
+  first = proc.stdout.read1(chunk_size)
+  if not first:
+    err = proc.stderr.read()
+    proc.stdout.close()
+    proc.stderr.close()
+    if proc.wait() != 0:
+      raise DoesNotExist(dec(err).strip())
+
+  def chunks():
+    try:
+      if first:
+        yield first
+        while True:
+          chunk = proc.stdout.read1(chunk_size)
+          if not chunk: break
+          yield chunk
+    finally:
+      if not proc.stdout.closed:
+        proc.stdout.close()
+        proc.stderr.close()
+        if proc.poll() is None:
+          proc.kill()
+        proc.wait()
+
+  return chunks()
+
+
+def object_sha(obj, cwd=None):
+  """
+  Returns the SHA of the object *obj* (eg. `worklog:user.tsv`) or #None if
+  it does not exist.
+  """
+
+  result = run(['git', 'rev-parse', '--verify', '--quiet', obj], cwd=cwd, check=False)
+  if result.code != 0:
+    return None
+  return dec(result.out).strip()
+
+
+def rev_parse(*args, cwd=None):
   """
   Wrapper for `git rev-parse`. Returns #None when "needed a single revision"
   error would be returned by Git.
@@ -178,7 +228,7 @@ def rev_parse(*args):
   # TODO: Of course, this only works with an English Git version.
 
   try:
-    return dec(run(['git', 'rev-parse'] + list(args)).out).strip()
+    return dec(run(['git', 'rev-parse'] + list(args), cwd=cwd).out).strip()
   except CalledProcessError as exc:
     if u'needed a single revision' in dec(exc.output).lower():
       return None
@@ -187,6 +237,50 @@ def rev_parse(*args):
     raise
 
 
+def iter_log(*args, format, cwd=None):
+  """
+  Runs a single `git log --format=<format>` process with the additional
+  *args* and yields its output line by line as it is produced. Raises a
+  #CalledProcessError with Git's error message in its *stderr* attribute
+  after the output is exhausted if Git failed.
+  """
+
+  cmd = ['git', 'log', '--format=' + format] + list(args)
+  proc = pipe(cmd, merge_err=False, cwd=cwd)
+  err = b''
+  try:
+    for line in proc.stdout:
+      yield dec(line).rstrip('\n')
+    err = proc.stderr.read()
+  finally:
+    proc.stdout.close()
+    proc.stderr.close()
+    if proc.poll() is None:
+      proc.kill()
+    code = proc.wait()
+  if code != 0:
+    raise CalledProcessError(code, cmd, None, err)
+
+
+def ls_tree(treeish, recursive=False, cwd=None):
+  """
+  Returns the names of the entries in *treeish*. If *recursive* is #True,
+  the paths of all files in sub-trees are returned instead of the sub-trees.
+  Raises #DoesNotExist if *treeish* is not a valid tree.
+  """
+
+  cmd = ['git', 'ls-tree', '--name-only', '-z']
+  if recursive:
+    cmd.append('-r')
+  try:
+    output = run(cmd + [treeish], merge_err=False, cwd=cwd).out
+  except CalledProcessError as exc:
+    if exc.returncode == 128:
+      raise DoesNotExist(dec(exc.stderr or b'').strip() or treeish)
+    raise
+  return [dec(x) for x in output.split(b'\0') if x]
+
+
 def fast_import(commit, date_format=None, quiet=False, cwd=None):
   cmd = ['git', 'fast-import']
   if date_format:
@@ -232,10 +326,21 @@ class DoesNotExist(Exception):
   pass
 
 
+class RefUpdateError(Exception):
+  """
+  Raised by #update_ref() when the ref could not be locked or when its
+  current value does not match the expected old value.
+  """
+
+
 class Commit(object):
   """
   Helper class to format a Git commit to a binary file-like object.
 
+  Besides the `git fast-import` stream that is written to *fp*, the commit
+  information is also kept in the #branch, #parent, #committer, #message and
+  #files attributes so that it can be written with #write_commit() instead.
+
   !!!note
       A lot of this code has been taken from the [MkDocs] source.
 
@@ -244,18 +349,27 @@ class Commit(object):
 
   def __init__(self, fp=None):
     self.fp = fp or io.BytesIO()
+    self.branch = None
+    self.parent = None
+    self.committer = None
+    self.message = None
+    self.files = []
 
-  def head(self, branch, message, uname=None, email=None, time=None):
+  def head(self, branch, message, uname=None, email=None, time=None, cwd=None):
     if time is None: time = datetime.now()
     if uname is None: uname = config('user.name')
     if email is None: email = config('user.email')
 
+    self.branch = branch
+    self.committer = '{} <{}> {}'.format(uname, email, mk_when(time))
+    self.message = message
     self.fp.write(enc('commit refs/heads/{}\n'.format(branch)))
-    self.fp.write(enc('committer {} <{}> {}\n'.format(uname, email, mk_when(time))))
+    self.fp.write(enc('committer {}\n'.format(self.committer)))
     self.fp.write(enc('data {}\n{}\n'.format(len(message), message)))
-    head = rev_parse(branch, '--')
+    head = rev_parse(branch, '--', cwd=cwd)
     if head:
       head = head.split()[0]
+      self.parent = head
       self.fp.write(enc('from {}\n'.format(head)))
     self.fp.write(enc('deleteall\n'))
 
@@ -270,6 +384,7 @@ class Commit(object):
       return self.add_file_contents(fp.read(), dstpath, mode)
 
   def add_file_contents(self, data, dstpath, mode='100644'):
+    self.files.append((mode, dstpath, enc(data)))
     self.fp.write(enc('M {} inline {}\n'.format(mode, dstpath)))
     self.fp.write(enc('data {}\n'.format(len(data))))  # TODO: Length of the encoded data, rather?
     self.fp.write(enc(data))
@@ -279,6 +394,172 @@ class Commit(object):
     return self.fp.getvalue()
 
 
+def common_dir(cwd=None):
+  """
+  Returns the Git directory that contains the `objects/` and `refs/` of the
+  repository at *cwd*. This differs from #dir() for linked worktrees.
+  """
+
+  git_dir = dir(cwd) or rev_parse('--absolute-git-dir', cwd=cwd)
+  if not git_dir:
+    raise DoesNotExist('not a git repository: {!r}'.format(cwd or os.getcwd()))
+  commondir_file = os.path.join(git_dir, 'commondir')
+  if os.path.isfile(commondir_file):
+    with open(commondir_file) as fp:
+      git_dir = os.path.normpath(os.path.join(git_dir, fp.read().strip()))
+  return git_dir
+
+
+def hash_object(type, data, write=False, cwd=None):
+  """
+  Computes the SHA-1 of a Git object of the specified *type* with the
+  contents *data*. If *write* is #True, the object is zlib-compressed and
+  stored as a loose object, unless it already exists.
+  """
+
+  data = enc(data)
+  raw = enc('{} {}\0'.format(type, len(data))) + data
+  sha = hashlib.sha1(raw).hexdigest()
+  if write:
+    objdir = os.path.join(common_dir(cwd), 'objects', sha[:2])
+    filename = os.path.join(objdir, sha[2:])
+    if not os.path.isfile(filename):
+      if not os.path.isdir(objdir):
+        os.makedirs(objdir, exist_ok=True)
+      tmp = os.path.join(objdir, 'tmp_obj_{}_{}'.format(os.getpid(), sha[2:]))
+      with open(tmp, 'wb') as fp:
+        fp.write(zlib.compress(raw))
+      os.chmod(tmp, 0o444)  # Git stores objects read-only.
+      os.replace(tmp, filename)
+  return sha
+
+
+def read_ref(ref, cwd=None):
+  """
+  Reads the SHA that the full *ref* name (eg. `refs/heads/worklog`) points
+  to from the loose ref file or `packed-refs`. Returns #None if the ref does
+  not exist. Symbolic refs are not supported.
+  """
+
+  git_dir = common_dir(cwd)
+  try:
+    with open(os.path.join(git_dir, ref)) as fp:
+      return fp.read().strip()
+  except (IOError, OSError):
+    pass
+  try:
+    with open(os.path.join(git_dir, 'packed-refs')) as fp:
+      for line in fp:
+        if line.startswith(('#', '^')):
+          continue
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == ref:
+          return parts[0]
+  except (IOError, OSError):
+    pass
+  return None
+
+
+def update_ref(ref, new, old=None, message=None, committer=None, cwd=None):
+  """
+  Atomically points the full *ref* name to the SHA *new*. The ref is locked
+  by creating `<ref>.lock` exclusively, and the lock file is renamed over
+  the ref after its current value was verified to match *old* (#None meaning
+  that the ref must not exist yet). Raises a #RefUpdateError otherwise.
+
+  If *committer* is given, an entry with *committer* and *message* is added
+  to the ref's reflog. Like Git, the reflog is created for branches unless
+  `core.logAllRefUpdates` is disabled (or unset in a bare repository), and
+  for all other refs if it is set to `always`.
+  """
+
+  git_dir = common_dir(cwd)
+  filename = os.path.join(git_dir, ref)
+  lockfile = filename + '.lock'
+  if not os.path.isdir(os.path.dirname(filename)):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+  try:
+    fd = os.open(lockfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+  except OSError as exc:
+    raise RefUpdateError('unable to lock {!r}: {}'.format(ref, exc))
+  try:
+    current = read_ref(ref, cwd=cwd)
+    if current != old:
+      raise RefUpdateError('{!r} is at {} but expected {}'.format(ref, current, old))
+    os.write(fd, enc(new + '\n'))
+    os.fsync(fd)
+    os.close(fd)
+    fd = None
+    os.replace(lockfile, filename)
+  except BaseException:
+    if fd is not None:
+      os.close(fd)
+    os.remove(lockfile)
+    raise
+
+  logfile = os.path.join(git_dir, 'logs', ref)
+  if committer and (os.path.isfile(logfile) or _should_create_reflog(ref, cwd)):
+    if not os.path.isdir(os.path.dirname(logfile)):
+      os.makedirs(os.path.dirname(logfile), exist_ok=True)
+    line = '{} {} {}\t{}\n'.format(old or '0' * 40, new, committer,
+      (message or '').split('\n')[0])
+    with open(logfile, 'ab') as fp:
+      fp.write(enc(line))
+
+
+def _should_create_reflog(ref, cwd=None):
+  value = config('core.logAllRefUpdates', cwd=cwd).lower()
+  if value == 'always':
+    return True
+  if not ref.startswith('refs/heads/') or value in ('false', 'no', 'off', '0'):
+    return False
+  if value:
+    return True
+  return config('core.bare', cwd=cwd).lower() != 'true'
+
+
+def _mk_tree(files, cwd=None):
+  # Builds the (possibly nested) tree objects for a list of (mode, path, data)
+  # tuples and returns the SHA of the root tree.
+  entries = {}
+  subtrees = collections.OrderedDict()
+  for mode, path, data in files:
+    name, sep, rest = path.lstrip('/').partition('/')
+    if sep:
+      subtrees.setdefault(name, []).append((mode, rest, data))
+    else:
+      entries[name] = (mode, hash_object('blob', data, write=True, cwd=cwd))
+  for name, subfiles in subtrees.items():
+    entries[name] = ('40000', _mk_tree(subfiles, cwd=cwd))
+
+  # Git sorts tree entries as if the names of sub-trees had a trailing slash.
+  key = lambda name: enc(name + '/' if entries[name][0] == '40000' else name)
+  data = b''
+  for name in sorted(entries, key=key):
+    mode, sha = entries[name]
+    data += enc('{} {}\0'.format(mode, name)) + bytes.fromhex(sha)
+  return hash_object('tree', data, write=True, cwd=cwd)
+
+
+def write_commit(commit, cwd=None):
+  """
+  Alternative to #fast_import() that writes the blobs, trees and the commit
+  object of a #Commit as loose objects and then moves the branch with
+  #update_ref(). Returns the SHA of the new commit.
+  """
+
+  tree = _mk_tree(commit.files, cwd=cwd)
+  data = 'tree {}\n'.format(tree)
+  if commit.parent:
+    data += 'parent {}\n'.format(commit.parent)
+  data += 'author {}\ncommitter {}\n\n{}'.format(
+    commit.committer, commit.committer, commit.message)
+  sha = hash_object('commit', data, write=True, cwd=cwd)
+  update_ref('refs/heads/' + commit.branch, sha, commit.parent,
+    commit.message, commit.committer, cwd=cwd)
+  return sha
+
+
 def mk_when(timestamp=None):
   if timestamp is None:
     timestamp = int(time.time())
@@ -24,6 +24,7 @@ import datetime
 import io
 import os
 import sys
+import time as _time
 
 if 'require' in globals():
   git = require('./git')
@@ -52,6 +53,8 @@ checkpoint_parser = subparsers.add_parser('checkpoint', description="""
 checkpoint_parser.add_argument('-m', '--message', help='A message for the log.')
 checkpoint_parser.add_argument('--time', type=timetable.parse_time,
   help='Override check-out and new check-in time.')
+checkpoint_parser.add_argument('--allow-overlap', action='store_true',
+  help='Commit the log even if it overlaps with an existing log.')
 
 checkout_parser = subparsers.add_parser('checkout', description="""
   Checks you out an adds an entry to your timetable file in the worklog
@@ -60,6 +63,27 @@ checkout_parser = subparsers.add_parser('checkout', description="""
 checkout_parser.add_argument('-m', '--message', help='A message for the log.')
 checkout_parser.add_argument('--time', type=timetable.parse_time,
   help='Override check-out time.')
+checkout_parser.add_argument('--allow-overlap', action='store_true',
+  help='Commit the log even if it overlaps with an existing log.')
+
+infer_parser = subparsers.add_parser('infer', description="""
+  Infers work logs from the commit history and adds them to the timetable
+  of the current (or the specified) user. Commits that are not more than
+  --gap apart are grouped into one log.
+""")
+infer_parser.add_argument('revisions', nargs='*', help='Revisions to read the history from.')
+infer_parser.add_argument('--since', help='Only consider commits after this date (see git log).')
+infer_parser.add_argument('--author', help='Only consider commits by this author (see git log). '
+  'Defaults to the --user name if specified, otherwise to your user.email.')
+infer_parser.add_argument('--all-authors', action='store_true',
+  help='Consider the commits of all authors.')
+infer_parser.add_argument('--user', help='User to add the logs for.')
+infer_parser.add_argument('--gap', type=timetable.parse_timedelta, default='1h',
+  help='Maximum time between two commits of the same log. (default: 1h)')
+infer_parser.add_argument('--lead', type=timetable.parse_timedelta, default='30m',
+  help='Time to add before the first commit of a log. (default: 30m)')
+infer_parser.add_argument('-n', '--dry-run', action='store_true',
+  help='Print the inferred logs instead of committing them.')
 
 report_parser = subparsers.add_parser('report', description="""
   Creates a easily readable worklog report. The filter options are similar
@@ -75,6 +99,10 @@ report_parser.add_argument('--strict', action='store_true',
     'at the time(s) specified with --begin and --end.')
 report_parser.add_argument('--raw', action='store_true',
   help='Raw output format (like git worklog show).')
+report_parser.add_argument('-f', '--follow', action='store_true',
+  help='Keep running and print logs as they are added.')
+report_parser.add_argument('--interval', type=float, default=60,
+  help='Seconds between checks for new logs with --follow. (default: 60)')
 
 
 show_parser = subparsers.add_parser('show', description="""
@@ -90,6 +118,11 @@ status_parser = subparsers.add_parser('status', description="""
 """)
 status_parser.add_argument('-d', '--detail', action='store_true')
 
+validate_parser = subparsers.add_parser('validate', description="""
+  Checks the timetables of all users for malformed rows, rows that are out
+  of order and logs that overlap.
+""")
+
 
 def print_err(*message):
   print(*message, file=sys.stderr)
@@ -127,7 +160,7 @@ def checkin(time):
   print('checked in: {} at {}'.format(data.name, timetable.strftime(data.time)))
 
 
-def checkout(message, time):
+def checkout(message, time, allow_overlap=False):
   try:
     checkin = timetable.get_checkin()
   except timetable.NoCheckinAvailable:
@@ -139,53 +172,150 @@ def checkout(message, time):
     print_err('fatal: check-out time can not be at a point in time before check-in.')
     return 1
 
-  data = timetable.add_checkout(checkin.name, checkin.time, time, message)
+  try:
+    data = timetable.add_checkout(checkin.name, checkin.time, time, message, allow_overlap)
+  except timetable.OverlapError as exc:
+    print_err('fatal: session overlaps with an existing log:')
+    print_err('       {}\t{}\t{}'.format(timetable.strftime(exc.log.begin),
+      timetable.strftime(exc.log.end), exc.log.message))
+    print_err('       use the --time argument or --allow-overlap on checkout.')
+    return 1
   timetable.rem_checkin()
   print('checked out: {}, interval is {}'.format(checkin.name, str(data.interval)))
 
 
-def report(args):
-  repo, branch = timetable.get_commit_repo_and_branch()
+def infer(args):
   user = args.user or git.config('user.name')
+  if not user:
+    print_err('fatal: user.name not configured.')
+    return 1
+
+  log_args = ['--no-merges']
+  if args.since:
+    log_args.append('--since=' + args.since)
+  if args.author:
+    log_args.append('--author=' + args.author)
+  elif not args.all_authors:
+    # Match the default author literally, it is not a pattern.
+    author = args.user or git.config('user.email')
+    if not author:
+      print_err('fatal: user.email not configured, use --author or --all-authors.')
+      return 1
+    log_args += ['--fixed-strings', '--author=' + author]
+  log_args += args.revisions
+
+  times = (datetime.datetime.fromisoformat(x) for x in git.iter_log(*log_args, format='%aI'))
   try:
-    data = git.show('{}:{}.tsv'.format(branch, user), cwd=repo)
-  except git.DoesNotExist as exc:
-    print_err(exc)
+    logs = timetable.infer_sessions(times, args.gap, args.lead)
+  except git.CalledProcessError as exc:
+    print_err(git.dec(exc.stderr or b'').strip() or
+      'fatal: git log failed with exit code {}'.format(exc.returncode))
     return 1
 
-  data = timetable.parse_sheet(data)
+  if args.dry_run:
+    for row in logs:
+      print('{}\t{}\t{}'.format(timetable.strftime(row.begin),
+        timetable.strftime(row.end), row.message))
+    return 0
+
+  added = timetable.add_logs(user, logs)
+  print('inferred {} log(s) for {}, {} skipped due to overlaps.'.format(
+    len(added), user, len(logs) - len(added)))
+
+
+def filter_logs(data, args):
+  # Filters are applied lazily so that the sheet is processed row by row.
   if args.begin:
     if args.strict:
-      data = [x for x in data if x.end >= args.begin]
+      data = (x for x in data if x.end >= args.begin)
     else:
-      data = [x for x in data if x.begin >= args.begin]
+      data = (x for x in data if x.begin >= args.begin)
   if args.end:
     if args.strict:
-      data = [x for x in data if x.begin <= args.end]
+      data = (x for x in data if x.begin <= args.end)
     else:
-      data = [x for x in data if x.begin <= args.end]
+      data = (x for x in data if x.begin <= args.end)
+  return data
+
+
+def report(args):
+  repo, branch = timetable.get_commit_repo_and_branch()
+  user = args.user or git.config('user.name')
+  if args.follow:
+    return report_follow(args, user, branch, repo)
+  try:
+    data = timetable.iter_user_sheet(user, branch, repo)
+  except git.DoesNotExist as exc:
+    print_err(exc)
+    return 1
 
+  data = filter_logs(data, args)
   if args.raw:
     for row in data:
-      print('{}\t{}\t{}'.format(timetable.strftime(row.begin),
-        timetable.strftime(row.end), row.message))
+      print_report_row(row, True)
     return 0
   else:
-    strftime = lambda x: x.strftime('%a %b %d %H:%M:%S %Y %z')
     tdelta_sum = datetime.timedelta()
-    print('Worklog for', user)
-    print('From:', strftime(args.begin)) if args.begin else 0
-    print('To:  ', strftime(args.end))if args.end else 0
-    print()
+    print_report_head(user, args)
     for row in data:
-      tdelta = row.end - row.begin
-      tdelta_sum += tdelta
-      print('  * {} ({})'.format(strftime(row.begin), timetable.strftimedelta(tdelta)))
-      print('    {}'.format(row.message))
-      print()
+      tdelta_sum += print_report_row(row, False)
     print('Total:', timetable.strftimedelta(tdelta_sum))
 
 
+def report_follow(args, user, branch, repo):
+  follower = timetable.SheetFollower(user, branch, repo)
+  tdelta_sum = datetime.timedelta()
+  if not args.raw:
+    print_report_head(user, args)
+  first = True
+  try:
+    while True:
+      result = follower.poll()
+      if result is not None:
+        rescanned, logs = result
+        if rescanned:
+          tdelta_sum = datetime.timedelta()
+          print_err('note: worklog history was rewritten, starting over.')
+        printed = False
+        for row in filter_logs(logs, args):
+          tdelta_sum += print_report_row(row, args.raw)
+          printed = True
+        # The tip also moves when the sheets of other users change.
+        if not args.raw and (printed or rescanned or first):
+          print('Total:', timetable.strftimedelta(tdelta_sum))
+          print()
+        sys.stdout.flush()
+        first = False
+      _time.sleep(args.interval)
+  except KeyboardInterrupt:
+    return 0
+
+
+def print_report_head(user, args):
+  strftime = lambda x: x.strftime('%a %b %d %H:%M:%S %Y %z')
+  print('Worklog for', user)
+  print('From:', strftime(args.begin)) if args.begin else 0
+  print('To:  ', strftime(args.end))if args.end else 0
+  print()
+
+
+def print_report_row(row, raw):
+  """
+  Prints a #timetable.Log for the report and returns its duration.
+  """
+
+  if raw:
+    print('{}\t{}\t{}'.format(timetable.strftime(row.begin),
+      timetable.strftime(row.end), row.message))
+  else:
+    strftime = lambda x: x.strftime('%a %b %d %H:%M:%S %Y %z')
+    tdelta = row.end - row.begin
+    print('  * {} ({})'.format(strftime(row.begin), timetable.strftimedelta(tdelta)))
+    print('    {}'.format(row.message))
+    print()
+  return row.end - row.begin
+
+
 def show(user):
   repo, branch = timetable.get_commit_repo_and_branch()
   user = user or git.config('user.name')
@@ -214,6 +344,27 @@ def status(detail):
         timetable.strftime(data.time), info))
 
 
+def validate():
+  repo, branch = timetable.get_commit_repo_and_branch()
+  try:
+    users = timetable.list_sheets(branch, repo)
+  except git.DoesNotExist as exc:
+    print_err(exc)
+    return 1
+
+  count = 0
+  for user in users:
+    filename = user + '.tsv'
+    chunks = git.cat_blob('{}:{}'.format(branch, filename), cwd=repo)
+    for lineno, message in sorted(timetable.validate_sheet(chunks)):
+      print('{}:{}: {}'.format(filename, lineno, message))
+      count += 1
+
+  if count:
+    print_err('{} problem(s) found.'.format(count))
+    return 1
+
+
 def main(argv=None):
   args = parser.parse_args(argv)
   if not args.command:
@@ -224,17 +375,21 @@ def main(argv=None):
   elif args.command == 'checkin':
     return checkin(args.time)
   elif args.command == 'checkpoint':
-    res = checkout(args.message, args.time)
+    res = checkout(args.message, args.time, args.allow_overlap)
     if res not in (0, None): return res
     return checkin(args.time)
   elif args.command == 'checkout':
-    return checkout(args.message, args.time)
+    return checkout(args.message, args.time, args.allow_overlap)
+  elif args.command == 'infer':
+    return infer(args)
   elif args.command == 'report':
     return report(args)
   elif args.command == 'show':
     return show(args.user)
   elif args.command == 'status':
     return status(args.detail)
+  elif args.command == 'validate':
+    return validate()
   else:
     print('fatal: invalid command {}'.format(args.command), file=sys.stderr)
     return 128
@@ -20,8 +20,15 @@
 
 from datetime import datetime, timezone, timedelta
 from collections import namedtuple
+import bisect
+import calendar
 import errno
+import hashlib
+import heapq
+import itertools
 import os
+import re
+import struct
 import time
 import sys
 
@@ -31,6 +38,7 @@ else:
   from . import git
 
 BRANCH = 'worklog'
+BACKENDS = ('fast-import', 'native')
 now = datetime.now
 time_fmt = '%d/%b/%Y:%H:%M:%S %z'
 CheckinData = namedtuple('CheckinData', 'name time')
@@ -74,48 +82,209 @@ def strftimedelta(tdelta, components='DHMS'):
   return ', '.join(parts)
 
 
+def parse_timedelta(value):
+  """
+  Parses a duration like `90m`, `1h30m` or `2h` into a #timedelta. A plain
+  number is interpreted as minutes.
+  """
+
+  units = {'d': 'days', 'h': 'hours', 'm': 'minutes', 's': 'seconds'}
+  value = value.strip()
+  if value.isdigit():
+    return timedelta(minutes=int(value))
+  kwargs = {}
+  number = ''
+  for char in value:
+    if char.isdigit():
+      number += char
+    elif char in units and number and units[char] not in kwargs:
+      kwargs[units[char]] = int(number)
+      number = ''
+    else:
+      raise ValueError('invalid duration: {!r}'.format(value))
+  if number or not kwargs:
+    raise ValueError('invalid duration: {!r}'.format(value))
+  return timedelta(**kwargs)
+
+
+# Time formats supported by #parse_time(), in order of precedence. Fields
+# that are not part of a format are filled from the reference time, except
+# that formats with a day but no hour refer to the beginning of that day.
+time_formats = [
+  time_fmt,
+  '%H:%M',
+  '%H:%M:%S',
+  '%H-%M',
+  '%H-%M-%S',
+  '%d/%H:%M',
+  '%d/%H:%M:%S',
+  '%d',
+  '%d/%b',
+  '%m/%d/%H:%M',
+  '%m/%d/%H:%M:%S',
+]
+
+# Maps the supported format directives to the #datetime field they set
+# and the regular expression that matches them.
+_directives = {
+  'Y': ('year', r'\d{4}'),
+  'm': ('month', r'1[0-2]|0?[1-9]'),
+  'b': ('month', '|'.join(re.escape(x) for x in calendar.month_abbr if x)),
+  'd': ('day', r'3[01]|[12]\d|0?[1-9]'),
+  'H': ('hour', r'2[0-3]|[01]?\d'),
+  'M': ('minute', r'[0-5]?\d'),
+  'S': ('second', r'[0-5]?\d'),
+  'z': ('tzinfo', r'Z|[+-]\d\d:?\d\d'),
+}
+
+_month_numbers = {x.lower(): i for i, x in enumerate(calendar.month_abbr) if x}
+_relative_day_regex = re.compile(r'(today|yesterday|tomorrow)(?:\s+(.*))?$', re.I)
+_relative_delta_regex = re.compile(r'([+-])\s*(\w+)$')
+
+
+def _compile_time_formats(formats):
+  # Compiles the *formats* into a single regular expression with one
+  # alternative per format, in order. Returns the expression and a list
+  # that maps the index of each alternative to its directives.
+  alternatives = []
+  directives = []
+  for index, fmt in enumerate(formats):
+    pattern = ''
+    names = []
+    parts = iter(fmt.split('%'))
+    pattern += re.escape(next(parts))
+    for part in parts:
+      char, literal = part[:1], part[1:]
+      if char not in _directives:
+        raise ValueError('unsupported directive %{} in {!r}'.format(char, fmt))
+      pattern += '(?P<f{}{}>{})'.format(index, char, _directives[char][1])
+      pattern += re.escape(literal)
+      names.append(char)
+    alternatives.append('(?P<f{}>{})'.format(index, pattern))
+    directives.append(names)
+  regex = re.compile('(?:{})$'.format('|'.join(alternatives)), re.I)
+  return regex, directives
+
+_time_regex, _time_directives = _compile_time_formats(time_formats)
+
+
+def _parse_tz(value):
+  if value.upper() == 'Z':
+    return timezone.utc
+  sign = -1 if value[0] == '-' else 1
+  value = value[1:].replace(':', '')
+  return timezone(sign * timedelta(hours=int(value[:2]), minutes=int(value[2:])))
+
+
 def parse_time(value, dt=None):
   """
   Parses a time string in multiple possible variants and otherwise applies
   the defaults from *dt*. If *dt* is not specified, the result of #now() is
   used.
+
+  All formats in #time_formats are matched by a single regular expression.
+  Additionally, an offset relative to *dt* (eg. `-15m` or `+1h30m`) and a
+  day relative to *dt* optionally followed by a time in one of the other
+  formats (eg. `yesterday` or `yesterday 17:00`) are supported.
   """
 
-  # Intentionally leaving out microseconds.
-  fields = ['year', 'month', 'day', 'hour', 'minute', 'second', 'tzinfo']
-  formats = [
-    (time_fmt, []),
-    ('%H:%M', ['hour', 'minute']),
-    ('%H:%M:%S', ['hour', 'minute', 'second']),
-    ('%H-%M', ['hour', 'minute']),
-    ('%H-%M-%S', ['hour', 'minute', 'second']),
-    ('%d/%H:%M', ['day', 'hour', 'minute']),
-    ('%d/%H:%M:%S', ['day', 'hour', 'minute', 'second']),
-    ('%d', ['day', '#0daytime']),
-    ('%d/%b', ['day', 'month', '#0daytime']),
-    ('%m/%d/%H:%M', ['month', 'day', 'hour', 'minute']),
-    ('%m/%d/%H:%M:%S', ['month', 'day', 'hour', 'minute', 'second']),
-  ]
-  for fmt, filled_fields in formats:
+  if dt is None:
+    dt = now()
+  value = value.strip()
+
+  match = _relative_day_regex.match(value)
+  if match:
+    offset = {'today': 0, 'yesterday': -1, 'tomorrow': 1}[match.group(1).lower()]
+    dt = dt + timedelta(days=offset)
+    if not match.group(2):
+      return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return parse_time(match.group(2), dt)
+
+  match = _relative_delta_regex.match(value)
+  if match:
     try:
-      result = datetime.strptime(value, fmt)
-      break
+      delta = parse_timedelta(match.group(2))
     except ValueError:
-      pass
-  else:
-    raise ValueError('invalid time string: {!r}'.format(value))
+      raise ValueError('invalid time string: {!r}'.format(value))
+    if match.group(1) == '-':
+      delta = -delta
+    return (dt + delta).replace(microsecond=0)
 
-  # Update the values that haven't been parsed.
-  if dt is None:
-    dt = now()
+  match = _time_regex.match(value)
+  if not match:
+    raise ValueError('invalid time string: {!r}'.format(value))
 
-  kwargs = {k: getattr(dt, k) for k in fields if k not in filled_fields}
-  if '#0daytime' in filled_fields:
+  # Intentionally leaving out microseconds.
+  index = int(match.lastgroup[1:])
+  kwargs = {'microsecond': 0}
+  for char in _time_directives[index]:
+    field = _directives[char][0]
+    group = match.group('f{}{}'.format(index, char))
+    if char == 'b':
+      kwargs[field] = _month_numbers[group.lower()]
+    elif char == 'z':
+      kwargs[field] = _parse_tz(group)
+    else:
+      kwargs[field] = int(group)
+  if 'day' in kwargs and 'hour' not in kwargs:
     kwargs['hour'] = 0
     kwargs['minute'] = 0
     kwargs['second'] = 0
 
-  return result.replace(**kwargs)
+  return dt.replace(**kwargs)
+
+
+def parse_times(values, dt=None):
+  """
+  Parses a list of time strings with #parse_time() against the same
+  reference time *dt*, which defaults to the result of #now().
+  """
+
+  if dt is None:
+    dt = now()
+  return [parse_time(value, dt) for value in values]
+
+
+def parse_line(line):
+  """
+  Parses a single row of a timetable sheet into a #Log entry.
+  """
+
+  cols = line.split('\t', 2)
+  if len(cols) != 3:
+    raise ValueError('invalid row: {!r}'.format(line))
+  cols[0] = strptime(cols[0])
+  cols[1] = strptime(cols[1])
+  return Log(*cols)
+
+
+def iter_lines(chunks, decode=True):
+  """
+  Splits an iterable of (binary or text) chunks into rows and yields them
+  as text as soon as they are complete. Only the current partial row is
+  kept in memory. If *decode* is #False, the rows are yielded as bytes.
+  """
+
+  convert = git.dec if decode else (lambda x: x)
+  buf = b''
+  for chunk in chunks:
+    lines = (buf + git.enc(chunk)).split(b'\n')
+    buf = lines.pop()
+    for line in lines:
+      yield convert(line)
+  if buf:
+    yield convert(buf)
+
+
+def iter_sheet(chunks):
+  """
+  Parses a timetable sheet from an iterable of (binary or text) chunks and
+  yields #Log entries as soon as a row is complete. Empty rows are skipped.
+  """
+
+  for line in iter_lines(chunks):
+    if line.strip():
+      yield parse_line(line)
 
 
 def parse_sheet(data):
@@ -123,13 +292,370 @@ def parse_sheet(data):
   Parses a timetable sheet and returns a list of #Log entries.
   """
 
-  result = []
-  for line in data.split('\n'):
-    cols = line.split('\t', 3)
-    cols[0] = strptime(cols[0])
-    cols[1] = strptime(cols[1])
-    result.append(Log(*cols))
-  return result
+  return list(iter_sheet([data]))
+
+
+def iter_user_sheet(user, branch=None, repo=None):
+  """
+  Streams the timetable sheet of *user* from the worklog branch and yields
+  #Log entries. If *branch* is not specified, the configured worklog
+  repository and branch are used. Raises #git.DoesNotExist if the user has
+  no sheet.
+  """
+
+  if branch is None:
+    repo, branch = get_commit_repo_and_branch()
+  return iter_sheet(git.cat_blob('{}:{}.tsv'.format(branch, user), cwd=repo))
+
+
+class IntervalIndex(object):
+  """
+  An index over the rows of a timetable sheet that finds a row overlapping
+  with a given interval in O(log n). It is stored in *filename* so that it
+  can be reused across invocations, and it belongs to the sheet whose blob
+  SHA is stored in its header, along with the number of non-empty rows in
+  that sheet.
+
+  The header is followed by one record per row that could be parsed,
+  sorted by begin time. Each record holds the begin time of its row and the
+  latest end time and the row number of the latest ending row up to and
+  including that record, thus the index also works for sheets that already
+  contain overlaps. All times are stored as Unix timestamps.
+  """
+
+  header = struct.Struct('<40sQ')
+  record = struct.Struct('<qqQ')
+
+  # Written to the header while the index is updated. It is not a SHA, so
+  # an index that was left in this state is never used.
+  invalid = b'-' * 40
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.sha = None
+    self.rows = 0
+    self.count = 0
+    if os.path.isfile(filename):
+      with open(filename, 'rb') as fp:
+        data = fp.read(self.header.size)
+        size = os.fstat(fp.fileno()).st_size
+      if len(data) == self.header.size:
+        sha, self.rows = self.header.unpack(data)
+        self.sha = git.dec(sha)
+        self.count = (size - self.header.size) // self.record.size
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, index):
+    # Returns the record at *index*. Allows #bisect to work on the file.
+    if not 0 <= index < self.count:
+      raise IndexError(index)
+    self._fp.seek(self.header.size + index * self.record.size)
+    return self.record.unpack(self._fp.read(self.record.size))
+
+  def build(self, sha, contents):
+    """
+    Writes the index for the sheet with the blob SHA *sha* and the text
+    *contents*. This parses every row of the sheet.
+    """
+
+    logs = []
+    rows = 0
+    for line in iter_lines([contents]):
+      if not line.strip():
+        continue
+      try:
+        log = parse_line(line)
+      except ValueError:
+        pass
+      else:
+        logs.append((int(log.begin.timestamp()), int(log.end.timestamp()), rows))
+      rows += 1
+    logs.sort()
+
+    makedirs(os.path.dirname(self.filename))
+    tmp = self.filename + '.tmp'
+    with open(tmp, 'wb') as fp:
+      fp.write(self.header.pack(git.enc(sha), rows))
+      max_end = max_row = None
+      for begin, end, row in logs:
+        if max_end is None or end > max_end:
+          max_end, max_row = end, row
+        fp.write(self.record.pack(begin, max_end, max_row))
+    os.replace(tmp, self.filename)
+    self.sha, self.rows, self.count = sha, rows, len(logs)
+
+  def find_overlap(self, begin, end):
+    """
+    Returns the number of a non-empty row in the sheet that overlaps with
+    the interval from *begin* to *end*, or #None. Intervals that only touch
+    each other do not overlap.
+    """
+
+    if not self.count:
+      return None
+    with open(self.filename, 'rb') as self._fp:
+      begins = _RecordField(self, 0)
+      k = bisect.bisect_left(begins, int(end.timestamp()))
+      if k == 0:
+        return None
+      _, max_end, max_row = self[k - 1]
+    return max_row if max_end > int(begin.timestamp()) else None
+
+  def append(self, sha, begin, end):
+    """
+    Adds a row from *begin* to *end* that was appended to the sheet, which
+    now has the blob SHA *sha*. Returns #False without changing the index
+    if the row does not begin after all other rows; the index must then be
+    built again.
+    """
+
+    begin, end = int(begin.timestamp()), int(end.timestamp())
+    with open(self.filename, 'r+b') as self._fp:
+      max_end = max_row = None
+      if self.count:
+        last_begin, max_end, max_row = self[self.count - 1]
+        if begin < last_begin:
+          return False
+      if max_end is None or end > max_end:
+        max_end, max_row = end, self.rows
+
+      # Invalidate the header first so that the index is built again if
+      # we are interrupted before the new SHA is written.
+      self._fp.seek(0)
+      self._fp.write(self.header.pack(self.invalid, 0))
+      self._fp.flush()
+      self._fp.seek(self.header.size + self.count * self.record.size)
+      self._fp.write(self.record.pack(begin, max_end, max_row))
+      self._fp.flush()
+      self._fp.seek(0)
+      self._fp.write(self.header.pack(git.enc(sha), self.rows + 1))
+    self.sha, self.rows, self.count = sha, self.rows + 1, self.count + 1
+    return True
+
+
+class _RecordField(object):
+  # A sequence view of one field of the records in an #IntervalIndex.
+
+  def __init__(self, index, field):
+    self.index = index
+    self.field = field
+
+  def __len__(self):
+    return len(self.index)
+
+  def __getitem__(self, i):
+    return self.index[i][self.field]
+
+
+def infer_sessions(times, gap, lead=timedelta()):
+  """
+  Groups an iterable of commit *times* into sessions and returns a list of
+  #Log entries, sorted by their begin time. A new session begins whenever
+  two consecutive commits are more than *gap* apart. Each session begins
+  *lead* before its first commit.
+
+  The times are expected in the (mostly) newest-first order of `git log`,
+  but sessions that end up overlapping, eg. because of rewritten author
+  dates or a *lead* larger than *gap*, are merged. Only the sessions are
+  kept in memory, not the individual commit times.
+  """
+
+  sessions = []
+  begin = end = None
+  count = 0
+  for time in times:
+    if begin is not None and begin - gap <= time <= end + gap:
+      begin, end = min(begin, time), max(end, time)
+      count += 1
+      continue
+    if begin is not None:
+      sessions.append((begin - lead, end, count))
+    begin = end = time
+    count = 1
+  if begin is not None:
+    sessions.append((begin - lead, end, count))
+
+  sessions.sort()
+  merged = []
+  for begin, end, count in sessions:
+    if merged and begin < merged[-1][1]:
+      last = merged[-1]
+      merged[-1] = (last[0], max(last[1], end), last[2] + count)
+    else:
+      merged.append((begin, end, count))
+  return [Log(begin, end, 'Inferred from {} commit(s)'.format(count))
+          for begin, end, count in merged]
+
+
+def get_interval_index(branch, filename, contents, repo=None):
+  """
+  Returns the #IntervalIndex for the timetable sheet *filename* in the
+  worklog *branch* with the text *contents*. The index is kept in the
+  `worklog/index/` directory of the Git directory and is only built again
+  if the SHA of the sheet's blob does not match the one it was built for.
+  """
+
+  path = os.path.join(git.common_dir(repo), 'worklog', 'index', branch, filename)
+  index = IntervalIndex(path)
+  sha = git.object_sha('{}:{}'.format(branch, filename), cwd=repo) or '0' * 40
+  if index.sha != sha:
+    index.build(sha, contents)
+  return index
+
+
+def get_row(contents, row):
+  """
+  Returns the #Log in the non-empty *row* of the sheet *contents*. Raises
+  a #ValueError if there is no such row.
+  """
+
+  lines = (line for line in iter_lines([contents]) if line.strip())
+  line = next(itertools.islice(lines, row, None), None)
+  if line is None:
+    raise ValueError('sheet has no row {}'.format(row))
+  return parse_line(line)
+
+
+def validate_sheet(chunks):
+  """
+  Checks a timetable sheet in a single pass over its rows and yields a
+  `(lineno, message)` tuple for every malformed row, every row that ends
+  before it begins or begins before the row preceding it, and every pair
+  of overlapping rows.
+  """
+
+  intervals = []
+  last = None
+  for lineno, line in enumerate(iter_lines(chunks, decode=False), 1):
+    if not line.strip():
+      continue
+    try:
+      log = parse_line(git.dec(line))
+    except ValueError as exc:  # Includes UnicodeDecodeError.
+      yield lineno, 'malformed row ({})'.format(exc)
+      continue
+    if log.end <= log.begin:
+      yield lineno, 'check-out is not after check-in'
+      continue
+    if last is not None and log.begin < last.begin:
+      yield lineno, 'out of order, begins before line {}'.format(last_lineno)
+    last, last_lineno = log, lineno
+    intervals.append((log.begin, log.end, lineno))
+
+  # Sweep over the rows sorted by begin time, keeping the rows that are
+  # still open in a heap ordered by their end time.
+  intervals.sort()
+  active = []
+  for begin, end, lineno in intervals:
+    while active and active[0][0] <= begin:
+      heapq.heappop(active)
+    for _, other in sorted(active, key=lambda x: x[1]):
+      yield max(lineno, other), 'overlaps with line {}'.format(min(lineno, other))
+    heapq.heappush(active, (end, lineno))
+
+
+class SheetFollower(object):
+  """
+  Follows the timetable sheet of *user* in the worklog *branch* and returns
+  only the rows that were appended since the last #poll(). The SHA of the
+  sheet's blob, the length of its complete rows and a SHA-1 over these rows
+  are remembered between polls. If the branch tip did not move, a poll only
+  reads the ref. If the rows seen so far were changed, the sheet is read
+  again from the start.
+  """
+
+  def __init__(self, user, branch, repo=None):
+    self.user = user
+    self.branch = branch
+    self.repo = repo
+    self.tip = None
+    self.blob = None
+    self.length = 0
+    self.digest = hashlib.sha1()
+
+  def reset(self):
+    self.blob = None
+    self.length = 0
+    self.digest = hashlib.sha1()
+
+  def poll(self):
+    """
+    Returns a tuple of `(rescanned, logs)` where *logs* is the list of #Log
+    entries that were appended since the last poll and *rescanned* is #True
+    if the sheet was read from the start because its history was rewritten.
+    Returns #None if the branch tip did not move.
+    """
+
+    tip = git.read_ref('refs/heads/' + self.branch, cwd=self.repo)
+    if tip == self.tip:
+      return None
+    self.tip = tip
+
+    obj = '{}:{}.tsv'.format(self.branch, self.user)
+    blob = git.object_sha(obj, cwd=self.repo) if tip else None
+    if blob == self.blob:
+      return False, []
+    if blob is None:
+      rescanned = self.length > 0
+      self.reset()
+      return rescanned, []
+
+    logs = self._read_tail(obj)
+    if logs is None:
+      self.reset()
+      logs = self._read_tail(obj)
+      rescanned = True
+    else:
+      rescanned = False
+    self.blob = blob
+    return rescanned, logs
+
+  def _read_tail(self, obj):
+    # Returns the rows after the first #length bytes of *obj* or #None if
+    # these bytes differ from the ones that have been seen before.
+    digest = hashlib.sha1()
+    skip = self.length
+    length = self.length
+    buf = b''
+    logs = []
+    chunks = git.cat_blob(obj, cwd=self.repo)
+    try:
+      for chunk in chunks:
+        if skip:
+          head, chunk = chunk[:skip], chunk[skip:]
+          digest.update(head)
+          skip -= len(head)
+          if skip:
+            continue
+          if digest.digest() != self.digest.digest():
+            return None
+        buf += chunk
+        end = buf.rfind(b'\n') + 1
+        if end:
+          digest.update(buf[:end])
+          logs.extend(iter_sheet([buf[:end]]))
+          length += end
+          buf = buf[end:]
+    finally:
+      chunks.close()
+    if skip:
+      return None
+    self.length = length
+    self.digest = digest
+    return logs
+
+
+class OverlapError(Exception):
+  """
+  Raised by #add_checkout() when the new log overlaps with the #Log that is
+  stored in the *log* attribute.
+  """
+
+  def __init__(self, log):
+    Exception.__init__(self, log)
+    self.log = log
 
 
 class NoCheckinAvailable(Exception):
@@ -158,6 +684,36 @@ def get_commit_repo_and_branch():
   return target_repo or None, target_branch
 
 
+def list_sheets(branch=None, repo=None):
+  """
+  Returns the names of the users that have a timetable sheet in the worklog
+  branch. If *branch* is not specified, the configured worklog repository
+  and branch are used.
+  """
+
+  if branch is None:
+    repo, branch = get_commit_repo_and_branch()
+  files = git.ls_tree(branch, recursive=True, cwd=repo)
+  return [x[:-4] for x in files if x.endswith('.tsv')]
+
+
+def write_commit(commit, cwd=None):
+  """
+  Writes a #git.Commit with the backend configured in `worklog.backend`,
+  which is either `fast-import` (the default) or `native`.
+  """
+
+  backend = git.config('worklog.backend') or BACKENDS[0]
+  if backend not in BACKENDS:
+    print('fatal: worklog.backend={}'.format(backend), file=sys.stderr)
+    print('       expected one of {}'.format(', '.join(BACKENDS)), file=sys.stderr)
+    sys.exit(128)
+  if backend == 'native':
+    git.write_commit(commit, cwd=cwd)
+  else:
+    git.fast_import(commit.getvalue(), date_format='raw', quiet=True, cwd=cwd)
+
+
 def set_checkin(name, time=None):
   time = time or now()
   filename = get_checkin_file()
@@ -189,7 +745,77 @@ def rem_checkin():
       raise
 
 
-def add_checkout(name, begin, end, message=None):
+def read_sheet(branch, filename, repo=None):
+  """
+  Returns the unmodified contents of the timetable sheet *filename* in the
+  worklog *branch*, or an empty string if it does not exist.
+  """
+
+  try:
+    return git.dec(b''.join(git.cat_blob('{}:{}'.format(branch, filename), cwd=repo)))
+  except git.DoesNotExist:
+    return ''
+
+
+def add_logs(name, logs, message=None, allow_overlap=False):
+  """
+  Commits multiple #Log entries to the timetable sheet of *name* at once.
+  The entries are merged into the existing rows in order of their begin
+  time. Entries that overlap with an existing row or with each other are
+  skipped, unless *allow_overlap* is #True. Returns the list of entries
+  that were added.
+  """
+
+  repo, branch = get_commit_repo_and_branch()
+  filename = name + '.tsv'
+  contents = read_sheet(branch, filename, repo)
+
+  index = get_interval_index(branch, filename, contents, repo)
+  added = []
+  for log in sorted(logs, key=lambda x: x.begin):
+    if not allow_overlap:
+      if index.find_overlap(log.begin, log.end) is not None:
+        continue
+      if added and added[-1].end > log.begin:
+        continue
+    added.append(log)
+  if not added:
+    return added
+
+  # Rows that can not be parsed keep their position after the row before.
+  def keyed_rows():
+    key = None
+    for line in iter_lines([contents]):
+      if not line.strip():
+        continue
+      try:
+        begin = parse_line(line).begin
+      except ValueError:
+        pass
+      else:
+        key = begin if key is None else max(key, begin)
+      yield key, line
+  new_rows = (
+    (log.begin, '{}\t{}\t{}'.format(strftime(log.begin), strftime(log.end), log.message))
+    for log in added)
+  merged = heapq.merge(keyed_rows(), new_rows, key=lambda x: (x[0] is not None, x[0]))
+  contents = ''.join(line + '\n' for _, line in merged)
+
+  message = message or 'Add {} log(s)'.format(len(added))
+  commit = git.Commit()
+  commit.head(branch, message, cwd=repo)
+  commit.add_file_contents(contents, filename)
+  write_commit(commit, cwd=repo)
+  return added
+
+
+def add_checkout(name, begin, end, message=None, allow_overlap=False):
+  """
+  Commits a log from *begin* to *end* to the timetable sheet of *name*.
+  Raises an #OverlapError if the log overlaps with an existing one, unless
+  *allow_overlap* is #True.
+  """
+
   interval = end - begin
   if not message:
     message = 'Checkout ' + str(interval)
@@ -198,20 +824,26 @@ def add_checkout(name, begin, end, message=None):
 
   # Read the contents of the timetable file for this user.
   filename = name + '.tsv'
-  try:
-    contents = git.show('{}:{}'.format(branch, filename), cwd=repo)
-  except git.DoesNotExist:
-    contents = ''
+  contents = read_sheet(branch, filename, repo)
+
+  index = get_interval_index(branch, filename, contents, repo)
+  if not allow_overlap:
+    row = index.find_overlap(begin, end)
+    if row is not None:
+      raise OverlapError(get_row(contents, row))
 
-  # Add an entry to the file.
-  if not contents.endswith('\n'):
+  # Add an entry to the file. The existing contents are kept byte for byte
+  # so that readers like #SheetFollower only need to read the new row.
+  if contents and not contents.endswith('\n'):
     contents += '\n'
   contents += '{}\t{}\t{}\n'.format(strftime(begin), strftime(end), message or '')
 
   # Create a commit to add the line to the timetable.
   commit = git.Commit()
-  commit.head(branch, message)
+  commit.head(branch, message, cwd=repo)
   commit.add_file_contents(contents, filename)
+  write_commit(commit, cwd=repo)
 
-  git.fast_import(commit.getvalue(), date_format='raw', quiet=True, cwd=repo)
+  # Extend the index for the new blob, which is what the commit stored.
+  index.append(git.hash_object('blob', contents), begin, end)
   return CheckoutData(name, begin, end, interval, message)
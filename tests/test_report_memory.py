@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROW = b'01/Jan/2020:10:00:00 +0000\t01/Jan/2020:11:00:00 +0000\tsome message\n'
+
+# Runs `git worklog report` for a user and prints the peak RSS in KiB.
+CHILD = '''
+import resource, sys
+from git_worklog import main
+sys.stdout = open(sys.argv[2], 'w')
+main.main(['report', '--user', sys.argv[1]])
+sys.stdout = sys.__stdout__
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def git(*args, cwd):
+  return subprocess.check_output(('git',) + args, cwd=cwd).decode().strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+  git('init', '-q', cwd=tmp_path)
+  git('config', 'user.name', 'tester', cwd=tmp_path)
+  git('config', 'user.email', 'tester@example.com', cwd=tmp_path)
+  for user, size in [('small', 1 << 20), ('large', 50 << 20)]:
+    filename = tmp_path / (user + '.tsv')
+    with open(filename, 'wb') as fp:
+      fp.write(ROW * (size // len(ROW)))
+    blob = git('hash-object', '-w', str(filename), cwd=tmp_path)
+    git('update-index', '--add', '--cacheinfo', '100644,{},{}.tsv'.format(blob, user), cwd=tmp_path)
+    os.remove(filename)
+  commit = git('commit-tree', git('write-tree', cwd=tmp_path), '-m', 'sheets', cwd=tmp_path)
+  git('update-ref', 'refs/heads/worklog', commit, cwd=tmp_path)
+  return tmp_path
+
+
+def peak_rss(repo, user):
+  env = dict(os.environ, PYTHONPATH=ROOT)
+  output = subprocess.check_output([sys.executable, '-c', CHILD, user,
+    str(repo / (user + '.out'))], cwd=repo, env=env)
+  return int(output)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='ru_maxrss is in KiB on Linux only')
+def test_report_peak_rss_does_not_grow_with_sheet_size(repo):
+  small = peak_rss(repo, 'small')
+  large = peak_rss(repo, 'large')
+  for user, size in [('small', 1 << 20), ('large', 50 << 20)]:
+    assert (repo / (user + '.out')).read_text().count('  * ') == size // len(ROW)
+  # A sheet 50 times larger must not need noticeably more memory.
+  assert large < small + 8 * 1024, (small, large)
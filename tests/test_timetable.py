@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from git_worklog import timetable
+
+ROW = u'01/Jan/2020:10:00:00 +0000\t01/Jan/2020:11:00:00 +0000\t{}\n'
+
+
+def split_every(data, size):
+  return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_sheet_rows_split_across_chunks():
+  data = (ROW.format('first') + ROW.format('second')).encode('utf-8')
+  for size in range(1, len(data) + 1):
+    logs = list(timetable.iter_sheet(split_every(data, size)))
+    assert [x.message for x in logs] == ['first', 'second']
+
+
+def test_iter_sheet_utf8_split_across_chunks():
+  data = ROW.format(u'Käse ☕').encode('utf-8')
+  for size in range(1, 8):
+    logs = list(timetable.iter_sheet(split_every(data, size)))
+    assert [x.message for x in logs] == [u'Käse ☕']
+
+
+def test_iter_sheet_without_trailing_newline():
+  data = (ROW.format('first') + ROW.format('last').rstrip('\n')).encode('utf-8')
+  logs = list(timetable.iter_sheet(split_every(data, 10)))
+  assert [x.message for x in logs] == ['first', 'last']
+
+
+def test_iter_sheet_skips_empty_rows_and_keeps_tabs():
+  data = '\n' + ROW.format('a\tb') + '\n\n'
+  logs = list(timetable.iter_sheet([data]))
+  assert len(logs) == 1
+  assert logs[0].message == 'a\tb'
+  assert logs[0].begin == datetime(2020, 1, 1, 10, tzinfo=timezone.utc)
+  assert logs[0].end - logs[0].begin == timedelta(hours=1)
+
+
+def make_sheet(*hours):
+  begin = datetime(2020, 1, 1, tzinfo=timezone.utc)
+  rows = []
+  for start, stop in hours:
+    rows.append(u'{}\t{}\tm\n'.format(timetable.strftime(begin + timedelta(hours=start)),
+      timetable.strftime(begin + timedelta(hours=stop))))
+  return begin, u''.join(rows)
+
+
+def test_interval_index_find_overlap_and_append(tmp_path):
+  begin, contents = make_sheet((0, 8), (2, 3), (10, 11))
+  at = lambda hours: begin + timedelta(hours=hours)
+  index = timetable.IntervalIndex(str(tmp_path / 'index'))
+  index.build('a' * 40, contents)
+  assert index.find_overlap(at(5), at(6)) == 0
+  assert index.find_overlap(at(8), at(10)) is None
+  assert index.find_overlap(at(10.5), at(12)) == 2
+  assert index.append('b' * 40, at(12), at(13))
+  assert not index.append('c' * 40, at(9), at(9.5))
+
+  index = timetable.IntervalIndex(str(tmp_path / 'index'))
+  assert (index.sha, index.rows, len(index)) == ('b' * 40, 4, 4)
+  assert index.find_overlap(at(12.5), at(14)) == 3
+
+
+def test_interval_index_interrupted_update_is_not_trusted(tmp_path):
+  begin, contents = make_sheet((0, 1))
+  index = timetable.IntervalIndex(str(tmp_path / 'index'))
+  index.build('0' * 40, contents)
+  with open(index.filename, 'r+b') as fp:
+    fp.write(index.header.pack(index.invalid, 0))
+  index = timetable.IntervalIndex(str(tmp_path / 'index'))
+  assert index.sha not in ('0' * 40, 'a' * 40)
+
+
+def test_get_row_out_of_range():
+  begin, contents = make_sheet((0, 1))
+  assert timetable.get_row(contents, 0).begin == begin
+  with pytest.raises(ValueError):
+    timetable.get_row(contents, 1)
+
+
+def test_infer_sessions_merges_overlapping_sessions():
+  at = lambda minutes: datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minutes)
+  # Newest first, with one commit whose author date is out of order.
+  times = [at(300), at(280), at(100), at(90), at(310)]
+  logs = timetable.infer_sessions(times, timedelta(minutes=30), timedelta(minutes=15))
+  assert [(x.begin, x.end, x.message) for x in logs] == [
+    (at(75), at(100), 'Inferred from 2 commit(s)'),
+    (at(265), at(310), 'Inferred from 3 commit(s)'),
+  ]
+
+  # A lead larger than the gap makes consecutive sessions overlap.
+  logs = timetable.infer_sessions([at(100), at(50)], timedelta(minutes=30), timedelta(minutes=60))
+  assert [(x.begin, x.end, x.message) for x in logs] == [(at(-10), at(100), 'Inferred from 2 commit(s)')]